@@ -0,0 +1,132 @@
+"""
+Load generator for the prediction service (src/server.py).
+
+    python -m src.server --port 8080 &
+    python -m benchmarks.loadgen --port 8080 --concurrency 32 --requests 5000
+    python -m benchmarks.loadgen --unix /tmp/faers.sock --output loadgen.json
+
+Each of --concurrency clients keeps one keep-alive connection open and sends
+/predict requests back to back with random seeded patient profiles. Reports
+throughput and client-side latency percentiles, and the server's batch size
+percentiles from /metrics.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def medication_names(scaler_path: str) -> list:
+    import joblib
+    names = joblib.load(scaler_path).feature_names_in_[3:]
+    return [name[len("Product_"):] if name.startswith("Product_") else name for name in names]
+
+def make_profiles(count: int, medications: list, max_medications: int, seed: int) -> list:
+    rng = np.random.default_rng(seed)
+    return [{
+        "sex": ["Male", "Female"][rng.integers(2)],
+        "age": int(rng.integers(65, 101)),
+        "weight": round(float(rng.uniform(40, 186)), 1),
+        "medications": list(rng.choice(medications, rng.integers(1, max_medications + 1), replace=False))
+    } for _ in range(count)]
+
+async def connect(args):
+    if args.unix:
+        return await asyncio.open_unix_connection(args.unix)
+    return await asyncio.open_connection(args.host, args.port)
+
+async def request(reader, writer, method: str, path: str, body: bytes=b"") -> tuple:
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return (status, await reader.readexactly(length))
+
+async def client(args, bodies: list, latencies: list, statuses: list) -> None:
+    reader, writer = await connect(args)
+    try:
+        while bodies:
+            body = bodies.pop()
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, "POST", "/predict", body)
+            latencies.append(time.perf_counter() - start)
+            statuses.append(status)
+    finally:
+        writer.close()
+
+async def server_batch_sizes(args) -> dict:
+    reader, writer = await connect(args)
+    try:
+        _, metrics = await request(reader, writer, "GET", "/metrics")
+    finally:
+        writer.close()
+    # Cumulative over the server's lifetime, not only this run
+    sizes = {}
+    for line in metrics.decode("utf-8").splitlines():
+        if line.startswith("faers_predict_batch_size{quantile="):
+            quantile, value = line[len('faers_predict_batch_size{quantile="'):].split('"} ')
+            sizes[f"p{round(float(quantile) * 100)}"] = float(value)
+        elif line.startswith("faers_predict_batch_size_count "):
+            sizes["batches"] = int(float(line.split()[1]))
+    return sizes
+
+async def run(args) -> dict:
+    medications = medication_names(args.scaler)
+    profiles = make_profiles(args.requests, medications, args.max_medications, args.seed)
+    bodies = [json.dumps(profile).encode("utf-8") for profile in profiles]
+    latencies, statuses = ([], [])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(args, bodies, latencies, statuses) for _ in range(args.concurrency)))
+    wall = time.perf_counter() - start
+
+    latencies = np.array(latencies)
+    percentiles = {f"p{int(q * 100)}": float(np.quantile(latencies, q)) for q in (0.5, 0.9, 0.99)}
+    percentiles["max"] = float(latencies.max())
+    return {
+        "requests": len(latencies),
+        "concurrency": args.concurrency,
+        "wall_s": wall,
+        "throughput": len(latencies) / wall,
+        "errors": sum(status != 200 for status in statuses),
+        "latency_s": percentiles,
+        "server_batch_size": await server_batch_sizes(args)
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Send concurrent /predict requests to the prediction service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix", default=None, help="Connect to this Unix socket instead of TCP")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent keep-alive connections")
+    parser.add_argument("--requests", type=int, default=2000, help="Total requests sent")
+    parser.add_argument("--max-medications", type=int, default=5, help="Most medications in a random profile")
+    parser.add_argument("--scaler", default=os.path.join(REPO_ROOT, "Models", "scaler.pkl"), help="Medication names are taken from this scaler")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results JSON here")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    latency = result["latency_s"]
+    print(f"{result['requests']} requests in {result['wall_s']:.2f} s, {result['throughput']:.1f} req/s, {result['errors']} errors")
+    print(f"latency p50 {latency['p50'] * 1000:.1f} ms  p90 {latency['p90'] * 1000:.1f} ms  p99 {latency['p99'] * 1000:.1f} ms  max {latency['max'] * 1000:.1f} ms")
+    print(f"server batch size {result['server_batch_size']}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+    return 1 if result["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+Offline benchmark suite for ingest, featurisation, training and inference.
+
+    python -m benchmarks.run --rows 1000000 --output results.json
+    python -m benchmarks.run --baseline results.json --threshold 0.2
+
+Each stage runs in a fresh process so its peak RSS is its own. Ingest uses a
+small fixture of real exports from data/, everything else uses seeded
+synthetic FAERS-shaped data. With --baseline the run exits 1 if any stage's
+throughput is below the baseline's by more than --threshold (a fraction), and
+exits 2 without comparing if the baseline was run with different workload
+options.
+"""
+import os
+import sys
+import json
+import queue
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_FILES = [
+    "INSULIN ASPART PROTAMINE AND INSULIN ASPART (P).xlsx",
+    "INSULIN ASPART RECOMBINANT (P).xlsx",
+    "Line Listing(dxjZy) (9).xlsx",
+    "INSULIN BEEF_PORK (G).xlsx"
+]
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _timed(function, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def _fixture_dir() -> str:
+    work_dir = tempfile.mkdtemp(prefix="faers-bench-")
+    os.makedirs(os.path.join(work_dir, "data"))
+    for file in FIXTURE_FILES:
+        shutil.copy(os.path.join(REPO_ROOT, "data", file), os.path.join(work_dir, "data", file))
+    return work_dir
+
+def bench_ingest(options: dict, cached: bool) -> dict:
+    from benchmarks.synthetic import COLUMNS
+    from src.preprocessing import DataPreprocessor
+
+    work_dir = _fixture_dir()
+    os.chdir(work_dir)
+    cache_dir = os.path.join(work_dir, ".cache") if cached else None
+    if cached:
+        DataPreprocessor(FIXTURE_FILES, COLUMNS, cache_dir=cache_dir)
+
+    rows = []
+    wall = _timed(lambda: rows.append(len(DataPreprocessor(FIXTURE_FILES, COLUMNS, cache_dir=cache_dir).data)), options["repeat"])
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return {"wall_s": wall, "items": rows[-1], "unit": "rows"}
+
+def _synthetic_preprocessor(options: dict):
+    from benchmarks.synthetic import make_faers_frame
+    from src.preprocessing import DataPreprocessor
+    return DataPreprocessor.from_dataframe(make_faers_frame(options["rows"], seed=options["seed"]))
+
+def bench_explode(options: dict) -> dict:
+    from src.preprocessing import DataPreprocessor
+    frame = _synthetic_preprocessor(options).data
+
+    def run():
+        preprocessor = DataPreprocessor.from_dataframe(frame.copy())
+        preprocessor.explode_column("Suspect Product Active Ingredients", ";")
+
+    return {"wall_s": _timed(run, options["repeat"]), "items": options["rows"], "unit": "rows"}
+
+def bench_get_dummies(options: dict) -> dict:
+    from src.preprocessing import DataPreprocessor
+    preprocessor = _synthetic_preprocessor(options)
+    preprocessor.explode_column("Suspect Product Active Ingredients", ";")
+    exploded = preprocessor.data[["Case ID", "Suspect Product Active Ingredients"]]
+
+    def run():
+        DataPreprocessor.from_dataframe(exploded.copy()).get_dummies(column_names=["Suspect Product Active Ingredients"], prefix=["Product"], sep="_")
+
+    return {"wall_s": _timed(run, options["repeat"]), "items": len(exploded), "unit": "rows"}
+
+def bench_multi_hot(options: dict) -> dict:
+    preprocessor = _synthetic_preprocessor(options)
+    run = lambda: preprocessor.get_multi_hot("Reactions", ";", prefix="Reaction_")
+    return {"wall_s": _timed(run, options["repeat"]), "items": options["rows"], "unit": "rows"}
+
+def _serious_model(features: int):
+    import torch
+    from src.model import Model, NeuralNetwork
+    torch.manual_seed(0)
+    model = Model()
+    model.model = NeuralNetwork(features, 1024, 1)
+    return model
+
+def bench_train_epoch(options: dict) -> dict:
+    from benchmarks.synthetic import make_feature_arrays
+    data, labels = make_feature_arrays(options["train_rows"], options["features"], seed=options["seed"])
+    model = _serious_model(options["features"])
+    run = lambda: model.train_model(data, labels, epochs=1)
+    return {"wall_s": _timed(run, options["repeat"]), "items": len(data), "unit": "rows"}
+
+def bench_predict_single(options: dict) -> dict:
+    from benchmarks.synthetic import make_feature_arrays
+    data, _ = make_feature_arrays(options["predict_calls"], options["features"], seed=options["seed"])
+    model = _serious_model(options["features"])
+
+    def run():
+        for row in data:
+            model.make_prediction(row)
+
+    return {"wall_s": _timed(run, options["repeat"]), "items": len(data), "unit": "predictions"}
+
+def bench_predict_batch(options: dict) -> dict:
+    from benchmarks.synthetic import make_feature_arrays
+    data, _ = make_feature_arrays(options["batch_size"], options["features"], seed=options["seed"])
+    model = _serious_model(options["features"])
+    run = lambda: model.make_prediction(data)
+    return {"wall_s": _timed(run, options["repeat"]), "items": len(data), "unit": "predictions"}
+
+BENCHMARKS = {
+    "ingest_cold": lambda options: bench_ingest(options, cached=False),
+    "ingest_cached": lambda options: bench_ingest(options, cached=True),
+    "explode": bench_explode,
+    "get_dummies": bench_get_dummies,
+    "multi_hot": bench_multi_hot,
+    "train_epoch": bench_train_epoch,
+    "predict_single": bench_predict_single,
+    "predict_batch": bench_predict_batch
+}
+
+def _run_stage(name: str, options: dict, queue) -> None:
+    sys.path.insert(0, REPO_ROOT)
+    result = BENCHMARKS[name](options)
+    result["throughput"] = result["items"] / result["wall_s"] if result["wall_s"] else None
+    result["peak_rss_mb"] = _peak_rss_mb()
+    queue.put(result)
+
+def run_stage(name: str, options: dict) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_stage, args=(name, options, results))
+    process.start()
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"Benchmark {name} failed with exit code {process.exitcode}")
+    process.join()
+    return result
+
+def environment() -> dict:
+    import numpy, pandas, torch, openpyxl, sklearn
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "torch": torch.__version__,
+        "openpyxl": openpyxl.__version__,
+        "sklearn": sklearn.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    }
+
+# Options that change the workload; --repeat only changes how many timings the fastest is taken from
+WORKLOAD_OPTIONS = ["rows", "train_rows", "features", "predict_calls", "batch_size", "seed"]
+
+def mismatched_options(options: dict, baseline: dict) -> list:
+    previous = baseline.get("options", {})
+    return [name for name in WORKLOAD_OPTIONS if previous.get(name) != options.get(name)]
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    # Throughput rather than wall time, so a stage is judged per row / prediction
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None or not previous.get("throughput") or not result["throughput"]:
+            continue
+        ratio = previous["throughput"] / result["throughput"]
+        if ratio > 1 + threshold:
+            regressions.append((name, previous["throughput"], result["throughput"], ratio))
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ingest, featurisation, training and inference.")
+    parser.add_argument("--rows", type=int, default=100000, help="Synthetic FAERS rows for the featurisation stages")
+    parser.add_argument("--train-rows", type=int, default=20000)
+    parser.add_argument("--features", type=int, default=2050, help="Model input width (scaler features)")
+    parser.add_argument("--predict-calls", type=int, default=1000, help="Single-row predictions timed")
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per stage, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="Run only these stages")
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed throughput drop against the baseline, as a fraction")
+    args = parser.parse_args(argv)
+
+    options = {
+        "rows": args.rows,
+        "train_rows": args.train_rows,
+        "features": args.features,
+        "predict_calls": args.predict_calls,
+        "batch_size": args.batch_size,
+        "repeat": args.repeat,
+        "seed": args.seed
+    }
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        results[name] = run_stage(name, options)
+        result = results[name]
+        print(f"{name:<16} {result['wall_s']:>10.4f} s  {result['throughput']:>14.1f} {result['unit']}/s  {result['peak_rss_mb']:>9.1f} MB peak RSS")
+
+    report = {"environment": environment(), "options": options, "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        mismatched = mismatched_options(options, baseline)
+        if mismatched:
+            details = ", ".join(f"{name} {baseline.get('options', {}).get(name)} -> {options[name]}" for name in mismatched)
+            print(f"Baseline was run with different options ({details}), not comparing", file=sys.stderr)
+            return 2
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: {before:.1f} -> {after:.1f} {results[name]['unit']}/s ({ratio:.2f}x slower)")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
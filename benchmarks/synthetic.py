@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['Case ID', 'Suspect Product Active Ingredients', 'Reason for Use', 'Reactions', 'Serious', 'Outcomes', 'Sex', 'Patient Age', 'Patient Weight']
+
+def _join_samples(rng: np.random.Generator, vocabulary: np.ndarray, rows: int, mean_count: float) -> list:
+    counts = 1 + rng.poisson(mean_count - 1, rows)
+    picks = rng.integers(0, len(vocabulary), counts.sum())
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    return [";".join(vocabulary[picks[start:end]]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+def make_faers_frame(rows: int, products: int=2000, reactions: int=4000, seed: int=0) -> pd.DataFrame:
+    """
+    FAERS line-listing shaped frame: same columns, ";"-joined multi-valued
+    fields and the same "83 YR" / "65 KG" / "Not Specified" value formats.
+    """
+    rng = np.random.default_rng(seed)
+    product_names = np.array([f"Product {i:05d}" for i in range(products)])
+    reaction_names = np.array([f"Reaction {i:05d}" for i in range(reactions)])
+
+    weights = rng.uniform(40, 186, rows).round(1).astype(str)
+    weights = np.where(rng.random(rows) < 0.6, "Not Specified", np.char.add(weights, " KG"))
+
+    return pd.DataFrame({
+        'Case ID': rng.integers(1_000_000, 1_000_000 + max(rows // 2, 1), rows),
+        'Suspect Product Active Ingredients': _join_samples(rng, product_names, rows, 3),
+        'Reason for Use': rng.choice(["Diabetes Mellitus", "Type 2 Diabetes Mellitus", "-"], rows),
+        'Reactions': _join_samples(rng, reaction_names, rows, 4),
+        'Serious': rng.choice(["Serious", "Non-Serious"], rows, p=[0.8, 0.2]),
+        'Outcomes': rng.choice(["Other Outcomes", "Hospitalized", "Died", "Life Threatening"], rows),
+        'Sex': rng.choice(["Male", "Female"], rows),
+        'Patient Age': np.char.add(rng.integers(65, 101, rows).astype(str), " YR"),
+        'Patient Weight': weights
+    })
+
+def make_feature_arrays(rows: int, features: int, outputs: int=1, seed: int=0) -> tuple:
+    rng = np.random.default_rng(seed)
+    data = rng.standard_normal((rows, features)).astype(np.float32)
+    labels = (rng.random((rows, outputs)) < 0.2).astype(np.float32)
+    return (data, labels)
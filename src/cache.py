@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import warnings
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+class FrameCache:
+    """
+    Columnar (Arrow IPC) cache of parsed source files.
+
+    Entries are keyed by the source path and the requested columns, and are
+    only reused while the source file's mtime and size are unchanged.
+    """
+    MANIFEST = "manifest.json"
+
+    def __init__(self, cache_dir: str=".cache") -> None:
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.manifest_path = os.path.join(self.cache_dir, self.MANIFEST)
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_manifest(self) -> None:
+        temp_path = f"{self.manifest_path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.manifest, file, indent=1)
+        os.replace(temp_path, self.manifest_path)
+
+    @staticmethod
+    def _key(path: str, usecols) -> str:
+        columns = None if usecols is None else list(usecols)
+        return json.dumps([os.path.abspath(path), columns])
+
+    @staticmethod
+    def _stamp(path: str) -> list:
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def get(self, path: str, usecols=None):
+        entry = self.manifest.get(self._key(path, usecols))
+        if entry is None or entry["stamp"] != self._stamp(path):
+            return None
+
+        entry_path = os.path.join(self.cache_dir, entry["file"])
+        try:
+            table = feather.read_table(entry_path, memory_map=True)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        return table.to_pandas()
+
+    def put(self, path: str, usecols, data: pd.DataFrame) -> None:
+        # Best effort: a frame that cannot be written is left uncached rather than failing the load
+        key = self._key(path, usecols)
+        file_name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".arrow"
+        entry_path = os.path.join(self.cache_dir, file_name)
+
+        # Write uncompressed so reads can be memory-mapped without decoding
+        temp_path = f"{entry_path}.tmp"
+        try:
+            feather.write_feather(data.reset_index(drop=True), temp_path, compression="uncompressed")
+            os.replace(temp_path, entry_path)
+        except (pa.ArrowException, TypeError, OSError) as error:
+            # e.g. Excel columns mixing numbers and text have no Arrow type; the load goes on uncached
+            warnings.warn(f"Could not cache {path} ({error}), it will be parsed again next time")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self.manifest[key] = {"file": file_name, "stamp": self._stamp(path)}
+        self._write_manifest()
+
+    def clear(self) -> None:
+        for entry in self.manifest.values():
+            entry_path = os.path.join(self.cache_dir, entry["file"])
+            if os.path.exists(entry_path):
+                os.remove(entry_path)
+        self.manifest = {}
+        self._write_manifest()
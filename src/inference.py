@@ -0,0 +1,277 @@
+import os
+import joblib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import torch
+
+from .model import Model
+from .labels import ReactionLabels
+from .instrumentation import instrumented, stage
+
+def select_reactions(probabilities: np.ndarray, labels: ReactionLabels, top_k: int=None) -> list:
+    indices = np.flatnonzero(labels.decide(probabilities, top_k))
+    if top_k is not None:
+        indices = indices[np.argsort(labels.thresholds[indices] - probabilities[indices])]
+    return list(zip(labels.names(indices), probabilities[indices]))
+
+def select_reactions_batch(probabilities: np.ndarray, labels: ReactionLabels, top_k: int=None) -> list:
+    rows, columns = np.nonzero(labels.decide(probabilities, top_k))
+    # Each selected label is decoded once per batch, however many patients it is reported for
+    names = dict(zip(np.unique(columns), labels.names(np.unique(columns))))
+    bounds = np.searchsorted(rows, np.arange(len(probabilities) + 1))
+
+    selected = []
+    for row in range(len(probabilities)):
+        row_columns = columns[bounds[row]:bounds[row + 1]]
+        if top_k is not None:
+            row_columns = row_columns[np.argsort(labels.thresholds[row_columns] - probabilities[row, row_columns])]
+        selected.append([(names[column], probabilities[row, column]) for column in row_columns])
+    return selected
+
+class PredictionCache:
+    """
+    Bounded LRU cache of (serious value, reaction probabilities) per patient profile.
+    """
+    def __init__(self, maxsize: int=4096) -> None:
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, serious_value: int, probabilities: np.ndarray) -> None:
+        if self.maxsize <= 0:
+            return
+        probabilities.setflags(write=False)
+        self.entries[key] = (serious_value, probabilities)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+# Shared by every session that is not given its own cache, so the GUI and batch callers reuse each other's results
+shared_prediction_cache = PredictionCache()
+
+class InferenceSession:
+    """
+    Holds the fitted scaler and both models for repeated predictions.
+
+    Everything that does not depend on the patient (scaler statistics, the
+    medication -> column index and the scaled all-zero row) is computed once
+    here, so a prediction only pays for filling in one row and the two
+    forward passes.
+    """
+    def __init__(self, serious_model: Model, reaction_model: Model, medications: list=None, scaler_path: str="Models/scaler.pkl", labels_path: str="Models/reaction_labels.npz", cache: PredictionCache=None, weight_bucket: float=None) -> None:
+        self.serious_model = serious_model
+        self.reaction_model = reaction_model
+        self.scaler_path = scaler_path
+        self.labels_path = labels_path
+        self._reaction_labels = None
+        self.cache = cache if cache is not None else shared_prediction_cache
+        self.weight_bucket = weight_bucket
+
+        self.load_scaler(medications)
+        self.loaded_artifacts = self.current_artifacts()
+        self.generation = self.current_generation()
+
+    def load_scaler(self, medications: list=None) -> None:
+        self.scaler = joblib.load(self.scaler_path)
+        self.scaler_stamp = self.file_stamp(self.scaler_path)
+
+        feature_names = getattr(self.scaler, "feature_names_in_", None)
+        if feature_names is not None:
+            # Column positions come from the order the scaler was fitted on
+            feature_index = {name: i for i, name in enumerate(feature_names)}
+            if medications is None:
+                medications = list(feature_names[3:])
+            self.medication_index = {med: feature_index[med] for med in medications if med in feature_index}
+        else:
+            self.medication_index = {med: i + 3 for i, med in enumerate(medications)}
+        self.medications = list(medications)
+
+        n_features = self.scaler.n_features_in_
+        self.mean = self.scaler.mean_ if self.scaler.mean_ is not None else np.zeros(n_features)
+        self.scale = self.scaler.scale_ if self.scaler.scale_ is not None else np.ones(n_features)
+        self.baseline = -self.mean / self.scale
+        self.taken = (1 - self.mean) / self.scale
+
+    @staticmethod
+    def file_stamp(path: str) -> tuple:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def current_artifacts(self) -> tuple:
+        return (self.scaler, self.serious_model.version, self.reaction_model.version)
+
+    def current_generation(self) -> tuple:
+        # Sessions over the same scaler file and model versions share cache entries
+        return (os.path.abspath(self.scaler_path), self.scaler_stamp, self.serious_model.version, self.reaction_model.version)
+
+    def refresh(self) -> None:
+        # Cached results are dropped whenever the scaler file changes or either model is reloaded or retrained
+        if self.file_stamp(self.scaler_path) != self.scaler_stamp:
+            self.load_scaler(self.medications)
+        artifacts = self.current_artifacts()
+        if artifacts[0] is not self.loaded_artifacts[0] or artifacts[1:] != self.loaded_artifacts[1:]:
+            self.loaded_artifacts = artifacts
+            self.generation = self.current_generation()
+            self._reaction_labels = None
+            self.cache.clear()
+
+    def profile_key(self, gender: int, age: float, weight: float, medications) -> tuple:
+        return (self.generation, int(gender), float(age), float(weight), tuple(sorted(set(medications))))
+
+    def bucket_weight(self, weight: float) -> float:
+        if self.weight_bucket is None:
+            return weight
+        return round(weight / self.weight_bucket) * self.weight_bucket
+
+    @property
+    def reaction_labels(self) -> ReactionLabels:
+        # Loaded on first use and checked against what the reaction model actually outputs
+        if self._reaction_labels is None:
+            output_dim = self.reaction_model.make_prediction(np.zeros(len(self.mean) + 1)).shape[-1]
+            self._reaction_labels = ReactionLabels.load(self.labels_path, output_dim=output_dim)
+        return self._reaction_labels
+
+    def medication_columns(self, medications) -> list:
+        try:
+            return [self.medication_index[med] for med in medications]
+        except KeyError as error:
+            raise ValueError(f"Unknown medication {error.args[0]!r}") from None
+
+    @instrumented()
+    def transform(self, criteria) -> np.ndarray:
+        return (np.asarray(criteria, dtype=np.float64) - self.mean) / self.scale
+
+    @instrumented()
+    def encode(self, gender: int, age: float, weight: float, medications) -> np.ndarray:
+        row = self.baseline.copy()
+        row[:3] = (np.array([gender, age, weight], dtype=np.float64) - self.mean[:3]) / self.scale[:3]
+        columns = self.medication_columns(medications)
+        row[columns] = self.taken[columns]
+        return row.reshape(1, -1)
+
+    @instrumented()
+    def encode_batch(self, genders, ages, weights, medications) -> np.ndarray:
+        rows = np.tile(self.baseline, (len(genders), 1))
+        patient = np.column_stack([genders, ages, weights]).astype(np.float64)
+        rows[:, :3] = (patient - self.mean[:3]) / self.scale[:3]
+
+        row_index = np.repeat(np.arange(len(rows)), [len(meds) for meds in medications])
+        columns = np.array(self.medication_columns(med for meds in medications for med in meds), dtype=np.intp)
+        rows[row_index, columns] = self.taken[columns]
+        return rows
+
+    def predict(self, gender: int, age: float, weight: float, medications) -> tuple:
+        self.refresh()
+        weight = self.bucket_weight(weight)
+        key = self.profile_key(gender, age, weight, medications)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        serious_value, reaction_probabilities = self.predict_uncached(gender, age, weight, medications)
+        self.cache.put(key, serious_value, reaction_probabilities)
+        return (serious_value, reaction_probabilities)
+
+    def predict_profiles(self, genders, ages, weights, medications) -> tuple:
+        self.refresh()
+        weights = [self.bucket_weight(weight) for weight in weights]
+        keys = [self.profile_key(*profile) for profile in zip(genders, ages, weights, medications)]
+        cached = [self.cache.get(key) for key in keys]
+        missing = [i for i, entry in enumerate(cached) if entry is None]
+
+        if missing:
+            criteria = self.encode_batch(
+                [genders[i] for i in missing],
+                [ages[i] for i in missing],
+                [weights[i] for i in missing],
+                [medications[i] for i in missing]
+            )
+            serious_values, reaction_probabilities = self.predict_scaled(criteria)
+            for i, serious_value, probabilities in zip(missing, serious_values, reaction_probabilities):
+                cached[i] = (int(serious_value), probabilities.copy())
+                self.cache.put(keys[i], *cached[i])
+
+        return (np.array([entry[0] for entry in cached]), np.stack([entry[1] for entry in cached]))
+
+    def predict_uncached(self, gender: int, age: float, weight: float, medications) -> tuple:
+        serious_criteria = self.encode(gender, age, weight, medications)
+
+        with stage("InferenceSession.serious_forward") as record:
+            serious_prediction = self.serious_model.make_prediction(serious_criteria)
+            record.rows = 1
+        serious_value = int(serious_prediction.item())
+
+        reaction_criteria = np.concatenate(([serious_value], serious_criteria[0]))
+        with stage("InferenceSession.reaction_forward") as record:
+            reaction_prediction = self.reaction_model.make_prediction(reaction_criteria)
+            record.rows = 1
+
+        return (serious_value, torch.sigmoid(reaction_prediction).numpy().flatten())
+
+    def align_columns(self, criteria: pd.DataFrame) -> np.ndarray:
+        # Only medication columns the caller left out are filled, as "not taken"; anything else is an error
+        feature_names = getattr(self.scaler, "feature_names_in_", None)
+        if feature_names is None:
+            return criteria.to_numpy(dtype=np.float64)
+
+        missing = [name for name in feature_names[:3] if name not in criteria.columns]
+        if missing:
+            raise ValueError(f"Missing required columns {missing}")
+        known = set(feature_names)
+        unknown = [name for name in criteria.columns if name not in known]
+        if unknown:
+            raise ValueError(f"{len(unknown)} columns are not features of the scaler, e.g. {unknown[:5]}")
+        return criteria.reindex(columns=feature_names, fill_value=0).to_numpy(dtype=np.float64)
+
+    def predict_batch(self, criteria) -> tuple:
+        if isinstance(criteria, pd.DataFrame):
+            criteria = self.align_columns(criteria)
+        criteria = np.asarray(criteria, dtype=np.float64)
+        if criteria.ndim != 2 or criteria.shape[1] != len(self.mean):
+            raise ValueError(f"Expected criteria of shape (patients, {len(self.mean)}), got {criteria.shape}")
+        finite = np.isfinite(criteria)
+        if not finite.all():
+            rows = np.flatnonzero(~finite.all(axis=1))
+            raise ValueError(f"{len(rows)} rows contain NaN or infinite values, e.g. rows {rows[:5].tolist()}")
+
+        return self.predict_scaled(self.transform(criteria))
+
+    def predict_scaled(self, serious_criteria: np.ndarray) -> tuple:
+        with stage("InferenceSession.serious_forward") as record:
+            serious_prediction = self.serious_model.make_prediction(serious_criteria)
+            record.observe(serious_prediction)
+        serious_values = serious_prediction.numpy().reshape(-1).astype(int)
+
+        reaction_criteria = np.column_stack((serious_values, serious_criteria))
+        with stage("InferenceSession.reaction_forward") as record:
+            reaction_prediction = self.reaction_model.make_prediction(reaction_criteria)
+            record.observe(reaction_prediction)
+
+        return (serious_values, torch.sigmoid(reaction_prediction).numpy())
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def _rss_bytes() -> int:
+    # Current RSS on Linux, peak RSS elsewhere, 0 where neither is available
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+def _shape(value) -> tuple:
+    shape = getattr(value, "shape", None)
+    if shape is None or len(shape) == 0:
+        return (None, None)
+    return (shape[0], shape[1] if len(shape) > 1 else 1)
+
+class StageStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.columns = None
+        self.memory_delta = 0
+        self.memory_growth = 0
+        self.memory_shrink = 0
+        self.max_memory_delta = 0
+
+    def add(self, seconds: float, rows: int, columns: int, memory_delta: int) -> None:
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        if rows is not None:
+            self.rows += rows
+        if columns is not None:
+            self.columns = columns
+        self.memory_delta += memory_delta
+        # RSS can fall as well as rise, so growth and shrink are kept apart as never-decreasing totals
+        self.memory_growth += max(memory_delta, 0)
+        self.memory_shrink += max(-memory_delta, 0)
+        self.max_memory_delta = max(self.max_memory_delta, memory_delta)
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "mean_seconds": self.seconds / self.calls if self.calls else 0.0,
+            "max_seconds": self.max_seconds,
+            "rows": self.rows,
+            "columns": self.columns,
+            "memory_delta_bytes": self.memory_delta,
+            "memory_growth_bytes": self.memory_growth,
+            "memory_shrink_bytes": self.memory_shrink,
+            "max_memory_delta_bytes": self.max_memory_delta
+        }
+
+class StageRecord:
+    """Handed out by stage(); set rows/columns (or call observe) to report the data the stage produced."""
+    __slots__ = ("rows", "columns")
+
+    def __init__(self) -> None:
+        self.rows = None
+        self.columns = None
+
+    def observe(self, value) -> None:
+        self.rows, self.columns = _shape(value)
+
+class Instrumentation:
+    """
+    In-process aggregate of per-stage wall time, row/column counts and RSS
+    change. Off by default: while disabled a hook costs one attribute check.
+    Enable with enable() or by setting FAERS_INSTRUMENTATION=1 before import.
+    """
+    def __init__(self, enabled: bool=False) -> None:
+        self.enabled = enabled
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stages = {}
+
+    def record(self, name: str, seconds: float, rows: int=None, columns: int=None, memory_delta: int=0) -> None:
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = StageStats()
+            self.stages[name].add(seconds, rows, columns, memory_delta)
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield StageRecord()
+            return
+
+        record = StageRecord()
+        rss = _rss_bytes()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.record(name, time.perf_counter() - start, record.rows, record.columns, _rss_bytes() - rss)
+
+    def instrumented(self, name: str=None):
+        """
+        Decorator form of stage(). Rows/columns come from the return value's
+        shape, or from self.data when the method works in place.
+        """
+        def decorator(function):
+            stage_name = name or function.__qualname__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+
+                rss = _rss_bytes()
+                start = time.perf_counter()
+                result = function(*args, **kwargs)
+                seconds = time.perf_counter() - start
+
+                rows, columns = _shape(result)
+                if rows is None and args:
+                    rows, columns = _shape(getattr(args[0], "data", None))
+                self.record(stage_name, seconds, rows, columns, _rss_bytes() - rss)
+                return result
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {name: stats.to_dict() for name, stats in self.stages.items()}
+
+    def to_json(self, indent: int=2) -> str:
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self, prefix: str="faers_stage") -> str:
+        metrics = [
+            ("calls_total", "counter", "Calls per stage", "calls"),
+            ("seconds_total", "counter", "Wall time per stage", "seconds"),
+            ("seconds_max", "gauge", "Slowest single call per stage", "max_seconds"),
+            ("rows_total", "counter", "Rows produced per stage", "rows"),
+            ("memory_growth_bytes_total", "counter", "RSS growth per stage, summed over calls that grew it", "memory_growth_bytes"),
+            ("memory_shrink_bytes_total", "counter", "RSS shrink per stage, summed over calls that shrank it", "memory_shrink_bytes"),
+            ("memory_delta_bytes_max", "gauge", "Largest RSS change of a single call per stage", "max_memory_delta_bytes")
+        ]
+        snapshot = self.snapshot()
+        lines = []
+        for suffix, metric_type, help_text, field in metrics:
+            metric = f"{prefix}_{suffix}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for name, stats in sorted(snapshot.items()):
+                label = name.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'{metric}{{stage="{label}"}} {stats[field]}')
+        return "\n".join(lines) + "\n"
+
+instrumentation = Instrumentation(enabled=os.environ.get("FAERS_INSTRUMENTATION", "") not in ("", "0"))
+stage = instrumentation.stage
+instrumented = instrumentation.instrumented
@@ -0,0 +1,71 @@
+import numpy as np
+
+LABELS_VERSION = 1
+
+class ReactionLabels:
+    """
+    Reaction label names and per-label decision thresholds for the reaction model.
+
+    Stored as a versioned .npz (no pickle): the names are one UTF-8 blob with
+    offsets, and are only decoded when a label is asked for.
+    """
+    def __init__(self, names_blob: np.ndarray, names_offsets: np.ndarray, thresholds: np.ndarray) -> None:
+        self.names_blob = names_blob
+        self.names_offsets = names_offsets
+        self.thresholds = thresholds
+
+    @classmethod
+    def from_lists(cls, names: list, thresholds: list):
+        encoded = [name.encode("utf-8") for name in names]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(name) for name in encoded])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(blob, offsets, np.asarray(thresholds, dtype=np.float32))
+
+    @classmethod
+    def load(cls, path: str="Models/reaction_labels.npz", output_dim: int=None):
+        with np.load(path, allow_pickle=False) as artifact:
+            version = int(artifact["version"])
+            if version != LABELS_VERSION:
+                raise ValueError(f"{path} has label format version {version}, expected {LABELS_VERSION}")
+            labels = cls(artifact["names_blob"], artifact["names_offsets"], artifact["thresholds"])
+
+        if output_dim is not None:
+            labels.validate(output_dim)
+        return labels
+
+    def save(self, path: str="Models/reaction_labels.npz") -> None:
+        np.savez_compressed(
+            path,
+            version=np.array(LABELS_VERSION),
+            names_blob=self.names_blob,
+            names_offsets=self.names_offsets,
+            thresholds=self.thresholds
+        )
+
+    def validate(self, output_dim: int) -> None:
+        if len(self.thresholds) != output_dim:
+            raise ValueError(f"Reaction model has {output_dim} outputs but {len(self.thresholds)} thresholds were loaded")
+        if len(self) != output_dim:
+            raise ValueError(f"Reaction model has {output_dim} outputs but {len(self)} label names were loaded")
+
+    def decide(self, probabilities: np.ndarray, top_k: int=None) -> np.ndarray:
+        # Works on a single (labels,) row or a (patients, labels) batch
+        margins = probabilities - self.thresholds
+        selected = margins >= 0
+        if top_k is not None and top_k < margins.shape[-1]:
+            top = np.argpartition(-margins, top_k - 1, axis=-1)[..., :top_k]
+            in_top = np.zeros_like(selected)
+            np.put_along_axis(in_top, top, True, axis=-1)
+            selected &= in_top
+        return selected
+
+    def name(self, index: int) -> str:
+        start, end = self.names_offsets[index], self.names_offsets[index + 1]
+        return self.names_blob[start:end].tobytes().decode("utf-8")
+
+    def names(self, indices) -> list:
+        return [self.name(index) for index in indices]
+
+    def __len__(self) -> int:
+        return len(self.names_offsets) - 1
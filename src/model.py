@@ -1,39 +1,141 @@
+import os
+import sys
+import pickle
+import itertools
+import zipfile
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, TensorDataset
+
+from .instrumentation import instrumented
+
+MODELS_DIR = "Models"
+MODEL_FORMAT_VERSION = 1
+
+def is_torchscript_file(path: str) -> bool:
+    # Legacy .pth files saved with _use_new_zipfile_serialization=False are plain pickles, not zips
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return any(name.endswith("/constants.pkl") for name in archive.namelist())
+
+def set_inference_threads(num_threads: int) -> None:
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(num_threads)
+    except RuntimeError:
+        # Can only be set before the first parallel operation runs
+        pass
+
+# Versions are never reused within a process, unlike id() of a collected network
+_model_versions = itertools.count(1)
 
 class Model:
     def __init__(self) -> None:
         self.model = None
 
+    @property
+    def model(self) -> nn.Module:
+        return self._model
+
+    @model.setter
+    def model(self, model: nn.Module) -> None:
+        self._model = model
+        self.mark_changed()
+
+    def mark_changed(self) -> None:
+        # Prediction caches key on this version. Assigning or loading a network and Trainer.fit call it;
+        # call it after changing the weights in place any other way (e.g. load_state_dict on self.model)
+        self.version = next(_model_versions)
+
+    @instrumented()
     def save_model(self, model_name: str) -> None:
-        torch.save(self.model.state_dict(), f"models/{model_name}")
+        artifact = {
+            "format_version": MODEL_FORMAT_VERSION,
+            "architecture": type(self.model).__name__,
+            "config": self.model.get_config(),
+            "state_dict": self.model.state_dict()
+        }
+        # Never written in place: a model loaded from this file still has its weights memory-mapped from it
+        path = os.path.join(MODELS_DIR, model_name)
+        temp_path = f"{path}.tmp"
+        torch.save(artifact, temp_path)
+        os.replace(temp_path, path)
 
-    def load_model(self, model_name: str="default.pth", weights: bool=False) -> None:
-        self.model = torch.load(f"models/{model_name}", weights_only=weights)
-        
+    @instrumented()
+    def export_model(self, model_name: str) -> None:
+        # Scripted and frozen in eval mode: dropout is removed and weights become constants the JIT can fold
+        scripted = torch.jit.script(self.model.eval())
+        frozen = torch.jit.optimize_for_inference(torch.jit.freeze(scripted))
+        torch.jit.save(frozen, os.path.join(MODELS_DIR, model_name))
 
-    def train_model(self, data, labels, epochs=50, batch_size=32) -> None:
-        data = torch.tensor(data, dtype=torch.float32)
-        labels = torch.tensor(labels, dtype=torch.float32)
+    @instrumented()
+    def load_model(self, model_name: str="default.pth", weights: bool=True) -> None:
+        path = os.path.join(MODELS_DIR, model_name)
+        if is_torchscript_file(path):
+            self.model = torch.jit.load(path, map_location="cpu")
+            return
+        if not weights:
+            # Whole pickled nn.Module from before the config + state_dict format, only use on trusted files
+            self.model = torch.load(path, weights_only=False)
+            return
+
+        legacy_message = f"{path} is a legacy pickled model, convert it once with Model.convert_legacy({model_name!r})"
+        if not zipfile.is_zipfile(path):
+            raise ValueError(legacy_message)
+        try:
+            artifact = torch.load(path, mmap=True, weights_only=True)
+        except pickle.UnpicklingError as error:
+            raise ValueError(legacy_message) from error
+        if artifact.get("format_version") != MODEL_FORMAT_VERSION:
+            raise ValueError(f"{path} has model format version {artifact.get('format_version')}, expected {MODEL_FORMAT_VERSION}")
+
+        # Built on the meta device so no weights are allocated, then pointed at the memory-mapped tensors
+        with torch.device("meta"):
+            model = ARCHITECTURES[artifact["architecture"]](**artifact["config"])
+        model.load_state_dict(artifact["state_dict"], assign=True)
+        self.model = model.eval()
+
+    @classmethod
+    def convert_legacy(cls, model_name: str) -> bool:
+        """
+        Re-saves a legacy whole-module pickle in Models/ in the config + state_dict
+        format, keeping the original as <name>.legacy. Returns False if the file
+        needed no conversion. Unpickling runs code, so only use on trusted files.
+        """
+        path = os.path.join(MODELS_DIR, model_name)
+        if zipfile.is_zipfile(path):
+            if is_torchscript_file(path):
+                return False
+            try:
+                torch.load(path, mmap=True, weights_only=True)
+                return False
+            except pickle.UnpicklingError:
+                pass
 
-        dataset = TensorDataset(data, labels)
-        dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
-        criterion = nn.MSELoss()
-        optimizer = optim.Adam(self.model.parameters(), lr=0.001)
-
-        for epoch in range(epochs):
-            epoch_loss = 0
-            for inputs, targets in dataloader:
-                optimizer.zero_grad()
-                outputs = self.model(inputs)
-                loss = criterion(outputs, targets)
-                loss.backward()
-                optimizer.step()
-                epoch_loss += loss.item()
-            print(f'Epoch {epoch+1}/{epochs}, Loss: {epoch_loss/len(dataloader)}')
+        # The notebooks that saved these had the network classes in __main__
+        main_module = sys.modules["__main__"]
+        added = [name for name in ARCHITECTURES if not hasattr(main_module, name)]
+        for name in added:
+            setattr(main_module, name, ARCHITECTURES[name])
+        try:
+            legacy = cls()
+            legacy.load_model(model_name, weights=False)
+        finally:
+            for name in added:
+                delattr(main_module, name)
 
+        os.replace(path, f"{path}.legacy")
+        legacy.save_model(model_name)
+        return True
+
+    @instrumented()
+    def train_model(self, data, labels, epochs=50, batch_size=32) -> None:
+        trainer = Trainer(self, loss_fn=nn.MSELoss(), batch_size=batch_size)
+        trainer.fit(data, labels, epochs=epochs)
+
+    @instrumented()
     def evaluate_model(self, data, labels) -> None:
         data = torch.tensor(data, dtype=torch.float32)
         labels = torch.tensor(labels, dtype=torch.float32)
@@ -45,12 +147,159 @@ class Model:
             loss = criterion(outputs, labels)
             print(f'Evaluation Loss: {loss.item()}')
     
+    @instrumented()
     def make_prediction(self, inputs: list) -> str:
-        inputs = torch.tensor(inputs, dtype=torch.float32)
-        self.model.eval()
-        with torch.no_grad():
+        inputs = torch.as_tensor(inputs, dtype=torch.float32)
+        if getattr(self.model, "training", False):
+            self.model.eval()
+        with torch.inference_mode():
             return self.model(inputs)
 
+def label_pos_weight(labels) -> torch.Tensor:
+    # Inverse label frequency, as used for BCEWithLogitsLoss(pos_weight=...) on the reaction labels
+    labels = torch.as_tensor(labels, dtype=torch.float32)
+    label_counts = labels.sum(dim=0).clamp(min=1)
+    return len(labels) / (labels.shape[1] * label_counts)
+
+class Trainer:
+    """
+    Mini-batch trainer over tensors held in memory.
+
+    Batches are gathered by indexing with a random permutation instead of a
+    DataLoader, losses are summed on-tensor and only read back once per epoch.
+    With a validation set the best weights are kept and training stops after
+    `patience` epochs without improvement. With a checkpoint path, state is
+    saved every epoch and an interrupted run resumes from the last epoch.
+    """
+    def __init__(self, model: Model, loss_fn: nn.Module=None, learning_rate: float=0.001, batch_size: int=32, patience: int=None, min_delta: float=0.0, checkpoint_path: str=None, seed: int=None) -> None:
+        self.model = model
+        self.loss_fn = loss_fn if loss_fn is not None else nn.BCELoss()
+        self.optimizer = optim.Adam(self.model.model.parameters(), lr=learning_rate)
+        self.batch_size = batch_size
+        self.patience = patience
+        self.min_delta = min_delta
+        self.checkpoint_path = checkpoint_path
+        # Unseeded trainers draw their seed from the global RNG, so torch.manual_seed still controls the shuffle order
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed if seed is not None else int(torch.randint(2**62, (1,))))
+
+        self.epoch = 0
+        self.best_loss = float("inf")
+        self.best_state = None
+        self.epochs_without_improvement = 0
+        self.stopped = False
+        self.history = {"train_loss": [], "valid_loss": []}
+
+    @staticmethod
+    def _tensors(data, labels) -> tuple:
+        data = torch.as_tensor(np.asarray(data, dtype=np.float32))
+        labels = torch.as_tensor(np.asarray(labels, dtype=np.float32))
+        return (data, labels.reshape(len(labels), -1))
+
+    def fit(self, data, labels, epochs: int=50, validation_data: tuple=None, validation_split: float=0.0, resume: bool=True) -> dict:
+        data, labels = self._tensors(data, labels)
+        if validation_data is not None:
+            valid_data, valid_labels = self._tensors(*validation_data)
+        elif validation_split > 0:
+            order = torch.randperm(len(data), generator=self.generator)
+            split = int(len(data) * (1 - validation_split))
+            data, valid_data = data[order[:split]], data[order[split:]]
+            labels, valid_labels = labels[order[:split]], labels[order[split:]]
+        else:
+            valid_data = valid_labels = None
+
+        if resume and self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            self.load_checkpoint()
+
+        while self.epoch < epochs and not self.stopped:
+            train_loss = self._train_epoch(data, labels)
+            self.history["train_loss"].append(train_loss)
+            self.epoch += 1
+            message = f'Epoch {self.epoch}/{epochs}, Loss: {train_loss}'
+
+            if valid_data is not None:
+                valid_loss = self.evaluate(valid_data, valid_labels)
+                self.history["valid_loss"].append(valid_loss)
+                message += f', Validation Loss: {valid_loss}'
+                self.stopped = self._track_best(valid_loss)
+            print(message)
+
+            if self.checkpoint_path:
+                self.save_checkpoint()
+            if self.stopped:
+                print(f'Early stopping after {self.epoch} epochs')
+
+        if self.best_state is not None:
+            self.model.model.load_state_dict(self.best_state)
+        self.model.mark_changed()
+        return self.history
+
+    @instrumented()
+    def _train_epoch(self, data: torch.Tensor, labels: torch.Tensor) -> float:
+        self.model.model.train()
+        order = torch.randperm(len(data), generator=self.generator)
+        total_loss = torch.zeros(())
+        batches = 0
+        for start in range(0, len(data), self.batch_size):
+            index = order[start:start + self.batch_size]
+            self.optimizer.zero_grad()
+            loss = self.loss_fn(self.model.model(data[index]), labels[index])
+            loss.backward()
+            self.optimizer.step()
+            total_loss += loss.detach()
+            batches += 1
+        return total_loss.item() / max(batches, 1)
+
+    def evaluate(self, data: torch.Tensor, labels: torch.Tensor, batch_size: int=4096) -> float:
+        self.model.model.eval()
+        total_loss = torch.zeros(())
+        with torch.inference_mode():
+            for start in range(0, len(data), batch_size):
+                outputs = self.model.model(data[start:start + batch_size])
+                total_loss += self.loss_fn(outputs, labels[start:start + batch_size]) * len(outputs)
+        return total_loss.item() / max(len(data), 1)
+
+    def _track_best(self, valid_loss: float) -> bool:
+        if valid_loss < self.best_loss - self.min_delta:
+            self.best_loss = valid_loss
+            self.best_state = {name: tensor.detach().clone() for name, tensor in self.model.model.state_dict().items()}
+            self.epochs_without_improvement = 0
+        else:
+            self.epochs_without_improvement += 1
+        return self.patience is not None and self.epochs_without_improvement >= self.patience
+
+    def save_checkpoint(self) -> None:
+        checkpoint = {
+            "epoch": self.epoch,
+            "model_state": self.model.model.state_dict(),
+            "optimizer_state": self.optimizer.state_dict(),
+            "best_loss": self.best_loss,
+            "best_state": self.best_state,
+            "epochs_without_improvement": self.epochs_without_improvement,
+            "history": self.history,
+            "generator_state": self.generator.get_state(),
+            "torch_rng_state": torch.get_rng_state(),
+            "stopped": self.stopped
+        }
+        # Written to a temporary file first so an interruption never leaves a truncated checkpoint
+        temp_path = f"{self.checkpoint_path}.tmp"
+        torch.save(checkpoint, temp_path)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def load_checkpoint(self) -> None:
+        checkpoint = torch.load(self.checkpoint_path, weights_only=True)
+        self.model.model.load_state_dict(checkpoint["model_state"])
+        self.optimizer.load_state_dict(checkpoint["optimizer_state"])
+        self.epoch = checkpoint["epoch"]
+        self.best_loss = checkpoint["best_loss"]
+        self.best_state = checkpoint["best_state"]
+        self.epochs_without_improvement = checkpoint["epochs_without_improvement"]
+        self.history = checkpoint["history"]
+        self.generator.set_state(checkpoint["generator_state"])
+        torch.set_rng_state(checkpoint["torch_rng_state"])
+        self.stopped = checkpoint["stopped"]
+        print(f'Resuming from epoch {self.epoch}')
+
 class NeuralNetwork(nn.Module):
     def __init__(self, input_dim, hidden_dim, output_dim):
         super(NeuralNetwork, self).__init__()
@@ -68,6 +317,13 @@ class NeuralNetwork(nn.Module):
         self.dropout = nn.Dropout(p=0.2)
         
         self.output_layer = nn.Linear(hidden_dim // 64, output_dim)  # Final output layer
+
+    def get_config(self) -> dict:
+        return {
+            "input_dim": self.layer_1.in_features,
+            "hidden_dim": self.layer_1.out_features * 16,
+            "output_dim": self.output_layer.out_features
+        }
         
     def forward(self, x):
         # Pass through layers with ReLU activations
@@ -112,6 +368,14 @@ class MultiOutputNeuralNetwork(nn.Module):
         self.output_layer = nn.Linear(hidden_dim // 128 + output_dim, output_dim)  # Final output layer
 
         self.dropout = nn.Dropout(p=0.2)  # Define dropout
+
+    def get_config(self) -> dict:
+        output_dim = self.output_layer.out_features
+        return {
+            "input_dim": self.layer_1.in_features,
+            "hidden_dim": (self.layer_1.out_features - output_dim) * 2,
+            "output_dim": output_dim
+        }
         
     def forward(self, x):
         # Pass through layers with ReLU activations
@@ -133,3 +397,7 @@ class MultiOutputNeuralNetwork(nn.Module):
         x = self.output_layer(x)
         return x
 
+ARCHITECTURES = {
+    "NeuralNetwork": NeuralNetwork,
+    "MultiOutputNeuralNetwork": MultiOutputNeuralNetwork
+}
@@ -1,31 +1,152 @@
 import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.model_selection import train_test_split
 
+from .cache import FrameCache
+from .instrumentation import instrumented
+from .vocabulary import Vocabulary
+
+def read_excel_file(file_path: str, usecols=None) -> pd.DataFrame:
+    return pd.read_excel(file_path, usecols=usecols)
+
+def stack_multi_hot(blocks: list) -> sparse.csr_matrix:
+    # Earlier blocks have no entries in columns added since, so widening them is only a shape change.
+    # The widened views share their arrays with the blocks, so the stacking is the only copy.
+    width = max(block.shape[1] for block in blocks)
+    widened = [sparse.csr_matrix((block.data, block.indices, block.indptr), shape=(block.shape[0], width)) for block in blocks]
+    return sparse.vstack(widened, format="csr")
+
+def extend_multi_hot(matrix: sparse.csr_matrix, new_matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    # A contiguous matrix costs a copy of every earlier row per call; keep the per-refresh blocks and
+    # call stack_multi_hot once when the matrix is needed if refreshes are frequent
+    return stack_multi_hot([matrix, new_matrix])
+
+def extend_scaler(scaler: StandardScaler, n_features: int, feature_names=None) -> None:
+    added = n_features - scaler.n_features_in_
+    if added <= 0:
+        return
+
+    # Every row seen so far had 0 in the new columns: mean 0, variance 0
+    if scaler.mean_ is not None:
+        scaler.mean_ = np.concatenate([scaler.mean_, np.zeros(added)])
+    if scaler.var_ is not None:
+        scaler.var_ = np.concatenate([scaler.var_, np.zeros(added)])
+    if scaler.scale_ is not None:
+        scaler.scale_ = np.concatenate([scaler.scale_, np.ones(added)])
+    if np.ndim(scaler.n_samples_seen_):
+        seen = np.full(added, scaler.n_samples_seen_.max(), dtype=scaler.n_samples_seen_.dtype)
+        scaler.n_samples_seen_ = np.concatenate([scaler.n_samples_seen_, seen])
+
+    scaler.n_features_in_ = n_features
+    if feature_names is not None:
+        scaler.feature_names_in_ = np.asarray(feature_names, dtype=object)
+    elif hasattr(scaler, "feature_names_in_"):
+        del scaler.feature_names_in_
+
 class DataPreprocessor:
-    def __init__(self, filepaths: list, join_on_column_names=[]) -> None:
+    def __init__(self, filepaths: list, join_on_column_names=[], cache_dir: str=".cache", workers: int=1) -> None:
+        self.cache = FrameCache(cache_dir) if cache_dir else None
+        self.workers = workers
+
         if len(filepaths) > 1:
-            self.data = pd.DataFrame(columns=join_on_column_names)
-            for file in filepaths:
-                file_path = os.path.join("data", file)
-                data = pd.read_excel(file_path, usecols=join_on_column_names)
-                self.data = pd.concat([self.data, data], ignore_index=True)
+            file_paths = [os.path.join("data", file) for file in filepaths]
+            frames = self._read_files(file_paths, join_on_column_names)
+            self.data = pd.concat(frames, ignore_index=True)
+            if join_on_column_names:
+                self.data = self.data[join_on_column_names]
         else:
-            self.data = pd.read_excel(filepaths[0])
+            self.data = self._read_files(filepaths[:1])[0]
 
         self.label_encoder = LabelEncoder()
+        self.scaler = None
+        self.case_ids = None
+
+    @property
+    def data(self) -> pd.DataFrame:
+        # Rows added by append_files are kept as separate chunks and only concatenated when the data is read
+        if self._chunks:
+            self._data = pd.concat([self._data] + self._chunks)
+            self._chunks = []
+        return self._data
+
+    @data.setter
+    def data(self, data: pd.DataFrame) -> None:
+        self._data = data
+        self._chunks = []
+
+    @classmethod
+    def from_dataframe(cls, data: pd.DataFrame):
+        preprocessor = cls.__new__(cls)
+        preprocessor.cache = None
+        preprocessor.workers = 1
+        preprocessor.data = data
+        preprocessor.label_encoder = LabelEncoder()
+        preprocessor.scaler = None
+        preprocessor.case_ids = None
+        return preprocessor
+
+    @instrumented()
+    def append_files(self, filepaths: list, join_on_column_names: list=None, id_column: str="Case ID") -> pd.DataFrame:
+        # Only the new files are read, and only cases not already loaded are kept
+        if join_on_column_names is None:
+            join_on_column_names = list(self._data.columns)
+        if self.case_ids is None:
+            self.case_ids = set(self._data[id_column])
+
+        file_paths = [os.path.join("data", file) for file in filepaths]
+        new_data = pd.concat(self._read_files(file_paths, join_on_column_names), ignore_index=True)[join_on_column_names]
+        new_data = new_data[~new_data[id_column].isin(self.case_ids)].drop_duplicates(id_column)
+
+        # Nothing already loaded is copied here: the new rows wait as a chunk until self.data is next read
+        loaded_rows = len(self._data) + sum(len(chunk) for chunk in self._chunks)
+        new_data.index = pd.RangeIndex(loaded_rows, loaded_rows + len(new_data))
+        self.case_ids.update(new_data[id_column])
+        self._chunks.append(new_data)
+        return new_data
+
+    @instrumented()
+    def _read_files(self, file_paths: list, usecols=None) -> list:
+        frames = [self.cache.get(file_path, usecols) if self.cache else None for file_path in file_paths]
+        missing = [i for i, frame in enumerate(frames) if frame is None]
+
+        # Results are placed back by position, so the frame order never depends on completion order
+        for i, data in zip(missing, self._parse_files([file_paths[i] for i in missing], usecols)):
+            frames[i] = data
+            if self.cache:
+                self.cache.put(file_paths[i], usecols, data)
+        return frames
+
+    @instrumented()
+    def _parse_files(self, file_paths: list, usecols=None) -> list:
+        workers = self.workers if self.workers is not None else os.cpu_count() or 1
+        workers = min(workers, len(file_paths))
+        if workers > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    return list(executor.map(read_excel_file, file_paths, [usecols] * len(file_paths)))
+            except (OSError, BrokenProcessPool) as error:
+                warnings.warn(f"Parallel Excel load failed ({error}), falling back to serial load")
+        return [read_excel_file(file_path, usecols) for file_path in file_paths]
 
     def drop_columns(self, column_names: list) -> None:
         self.data.drop(columns=column_names)
 
+    @instrumented()
     def explode_column(self, column_name: str, delimiter: str) -> None:
         self.data[column_name] = self.data[column_name].str.split(delimiter)
         self.data = self.data.explode(column_name)
     
+    @instrumented()
     def encode_column(self, column_name: str) -> None:
         self.data[column_name] = self.label_encoder.fit_transform(self.data[column_name])
     
+    @instrumented()
     def ensure_numeric_column(self, column_name: str, decimal=False) -> None:
         self.data[column_name] = self.data[column_name].str.replace(r'\D+', '', regex=True)
         if decimal:
@@ -34,23 +155,65 @@ class DataPreprocessor:
             self.data[column_name] = self.data[column_name].astype(int)
         self.data[column_name] = pd.to_numeric(self.data[column_name], errors='coerce')
     
+    @instrumented()
     def get_dummies(self, column_names: list, prefix: list, sep: str) -> None:
         self.data = pd.get_dummies(self.data, columns=column_names, prefix=prefix, prefix_sep=sep)
 
+    @instrumented()
+    def get_multi_hot(self, column_name: str, delimiter: str, id_column: str="Case ID", vocabulary: Vocabulary=None, prefix: str="", extend_vocabulary: bool=False, data: pd.DataFrame=None) -> tuple:
+        # Equivalent to explode + get_dummies + groupby(id_column).max(), built directly as a sparse matrix
+        data = self.data if data is None else data
+        case_codes, case_ids = pd.factorize(data[id_column], sort=True)
+        tokens = pd.Series(data[column_name].to_numpy(), dtype=object).str.split(delimiter).explode().dropna()
+
+        if vocabulary is None:
+            vocabulary = Vocabulary.from_values(tokens, prefix=prefix)
+        elif extend_vocabulary:
+            # New tokens are appended after the existing columns, never inserted between them
+            vocabulary.extend(sorted(pd.unique(tokens)))
+
+        rows = case_codes[tokens.index.to_numpy()]
+        cols = vocabulary.lookup(tokens.to_numpy())
+        known = cols >= 0
+
+        matrix = sparse.csr_matrix(
+            (np.ones(known.sum(), dtype=np.float32), (rows[known], cols[known])),
+            shape=(len(case_ids), len(vocabulary))
+        )
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return (np.asarray(case_ids), matrix, vocabulary)
+
+    @instrumented()
     def convert_nulls(self, column_name: str, nulls=["Not Specified"], output="NaN") -> None:
         for null in nulls:
             self.data[column_name] = self.data[column_name].replace(null, output)
 
+    @instrumented()
     def drop_all_nulls(self) -> None:
         self.data.dropna(inplace=True)
 
+    @instrumented()
     def get_standardised_train_test_split(self, x_columns: list, y: str, test_size: float, random_state: int) -> tuple:
         x_train, x_test, y_train, y_test = train_test_split(self.data[x_columns], self.data[y], test_size=test_size, random_state=random_state)
         scaler = StandardScaler()
         x_train = scaler.fit_transform(x_train)
         x_test = scaler.transform(x_test)
+        self.scaler = scaler
         return (x_train, x_test, y_train, y_test)
 
+    @instrumented()
+    def update_scaler(self, x) -> StandardScaler:
+        # Streaming update of the scaler's moments with new rows only, growing it if new feature columns were added
+        if sparse.issparse(x):
+            x = x.toarray()
+        if self.scaler is None:
+            self.scaler = StandardScaler()
+        else:
+            extend_scaler(self.scaler, x.shape[1], getattr(x, "columns", None))
+        self.scaler.partial_fit(x)
+        return self.scaler
+
     def get_value_counts(self, column_name: str) -> pd.DataFrame:
         return self.data[column_name].value_counts()
 
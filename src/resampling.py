@@ -0,0 +1,79 @@
+import numpy as np
+from scipy import sparse
+from sklearn.neighbors import NearestNeighbors
+
+class MLSMOTE:
+    """
+    Multi-label SMOTE: brings every label to `target_samples` examples.
+
+    Labels above the target are downsampled without replacement. Labels below
+    it get synthetic samples interpolated towards a Dirichlet-weighted mix of
+    their k-1 nearest neighbours, labelled with the union of the seed
+    sample's and its nearest neighbour's labels. Neighbours are found with one
+    batched query per label and samples are generated in chunks of
+    `chunk_size`, so memory stays bounded. Y may be a dense array or a scipy
+    sparse multi-hot matrix; it is returned in the same form.
+    """
+    def __init__(self, k: int=5, target_samples: int=4500, chunk_size: int=10000, random_state: int=None) -> None:
+        self.k = k
+        self.target_samples = target_samples
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+
+    def fit_resample(self, X, Y) -> tuple:
+        X_parts, Y_parts = zip(*self.iter_resample(X, Y))
+        if sparse.issparse(Y):
+            return (np.vstack(X_parts), sparse.vstack(Y_parts, format="csr"))
+        return (np.vstack(X_parts), np.vstack(Y_parts))
+
+    def iter_resample(self, X, Y):
+        """Yields (X, Y) blocks of the balanced dataset, one label at a time."""
+        rng = np.random.default_rng(self.random_state)
+        X = np.asarray(X)
+        if not np.issubdtype(X.dtype, np.floating):
+            X = X.astype(np.float64)
+        is_sparse = sparse.issparse(Y)
+        Y_rows = sparse.csr_matrix(Y) if is_sparse else np.asarray(Y)
+        # Column-major copy so each label's rows are a slice rather than a full scan
+        Y_columns = sparse.csc_matrix(Y_rows != 0)
+
+        for label_idx in range(Y_columns.shape[1]):
+            label_indices = Y_columns.indices[Y_columns.indptr[label_idx]:Y_columns.indptr[label_idx + 1]]
+            count = len(label_indices)
+            if count == 0:
+                continue
+
+            if count > self.target_samples:
+                chosen = label_indices[rng.choice(count, self.target_samples, replace=False)]
+                yield (X[chosen], Y_rows[chosen])
+                continue
+
+            yield (X[label_indices], Y_rows[label_indices])
+            if count < self.target_samples:
+                yield from self._synthesise(X[label_indices], Y_rows[label_indices], self.target_samples - count, rng)
+
+    def _synthesise(self, X_label: np.ndarray, Y_label, num_to_generate: int, rng: np.random.Generator):
+        n_neighbors = min(self.k, len(X_label))
+        neighbors = NearestNeighbors(n_neighbors=n_neighbors).fit(X_label).kneighbors(X_label, return_distance=False)
+        neighbors = neighbors[:, 1:]  # Exclude each sample itself
+
+        for start in range(0, num_to_generate, self.chunk_size):
+            size = min(self.chunk_size, num_to_generate - start)
+            seeds = rng.integers(len(X_label), size=size)
+            x = X_label[seeds]
+
+            if neighbors.shape[1] == 0:
+                # A label with a single example can only be duplicated
+                yield (x, Y_label[seeds])
+                continue
+
+            seed_neighbors = neighbors[seeds]
+            weights = rng.dirichlet(np.ones(seed_neighbors.shape[1]), size=size).astype(X_label.dtype)
+            neighbor_x = np.einsum("ck,ckf->cf", weights, X_label[seed_neighbors])
+            synthetic_x = x + rng.random((size, 1)).astype(X_label.dtype) * (neighbor_x - x)
+
+            if sparse.issparse(Y_label):
+                synthetic_y = Y_label[seeds].maximum(Y_label[seed_neighbors[:, 0]])
+            else:
+                synthetic_y = np.logical_or(Y_label[seeds], Y_label[seed_neighbors[:, 0]]).astype(Y_label.dtype)
+            yield (synthetic_x, synthetic_y)
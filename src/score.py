@@ -0,0 +1,153 @@
+"""
+Bulk scoring of patient files through the serious -> reaction models.
+
+    python -m src.score patients.csv results.csv
+    python -m src.score patients.parquet results.parquet --chunk-size 5000
+
+Each input row needs the columns "Sex" (Male/Female or 0/1), "Patient Age",
+"Patient Weight" and "Medications" (";"-separated active ingredients, with or
+without the "Product_" prefix). The output has one row per (patient, selected
+reaction) with the columns "Row" (input row number), "Serious", "Reaction" and
+"Reaction Probability"; a patient with no selected reaction gets one row with
+an empty "Reaction". A "Case ID" column, if present, is copied to the output.
+Rows with a missing or non-numeric age or weight are skipped and their row
+numbers reported on stderr. Rows are read, scored and written one chunk at a
+time.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .model import Model, set_inference_threads
+from .inference import InferenceSession, select_reactions_batch
+
+GENDERS = {"male": 0, "female": 1, "0": 0, "1": 1}
+INPUT_COLUMNS = ["Sex", "Patient Age", "Patient Weight", "Medications"]
+
+def read_chunks(path: str, chunk_size: int, id_column: str):
+    if path.endswith(".parquet"):
+        parquet_file = pq.ParquetFile(path)
+        columns = INPUT_COLUMNS + ([id_column] if id_column in parquet_file.schema_arrow.names else [])
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        usecols = lambda column: column in INPUT_COLUMNS or column == id_column
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=usecols, dtype={"Sex": str, "Medications": str})
+
+class ResultWriter:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.parquet_writer = None
+        self.header = True
+
+    def write(self, results: pd.DataFrame) -> None:
+        if self.path.endswith(".parquet"):
+            table = pa.Table.from_pandas(results, preserve_index=False)
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self.parquet_writer.write_table(table)
+        else:
+            results.to_csv(self.path, mode="w" if self.header else "a", header=self.header, index=False)
+            self.header = False
+
+    def close(self) -> None:
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+def parse_medications(value) -> list:
+    if not isinstance(value, str) or not value.strip():
+        return []
+    medications = [med.strip() for med in value.split(";") if med.strip()]
+    return [med if med.startswith("Product_") else f"Product_{med}" for med in medications]
+
+def score_chunk(session: InferenceSession, chunk: pd.DataFrame, id_column: str, top_k: int=None, row_offset: int=0) -> tuple:
+    """Returns (results, input row numbers skipped for a missing or non-numeric age or weight)."""
+    genders = chunk["Sex"].astype(str).str.strip().str.lower().map(GENDERS)
+    if genders.isna().any():
+        position = np.flatnonzero(genders.isna())[0]
+        raise ValueError(f"Unrecognised Sex value {chunk['Sex'].iloc[position]!r} in row {row_offset + position}")
+
+    # FAERS-style "Not Specified" or blank values would reach the models as NaN
+    ages = pd.to_numeric(chunk["Patient Age"], errors="coerce").to_numpy(dtype=np.float64)
+    weights = pd.to_numeric(chunk["Patient Weight"], errors="coerce").to_numpy(dtype=np.float64)
+    valid = np.isfinite(ages) & np.isfinite(weights)
+    skipped = row_offset + np.flatnonzero(~valid)
+    positions = np.flatnonzero(valid)
+    if len(positions) == 0:
+        return (None, skipped)
+
+    serious_values, reaction_probabilities = session.predict_profiles(
+        genders.to_numpy()[positions],
+        ages[positions],
+        weights[positions],
+        [parse_medications(value) for value in chunk["Medications"].to_numpy()[positions]]
+    )
+
+    # One output row per (patient, reaction): label names can contain ";" themselves, so they are never joined.
+    # Patients with no selected reaction keep one row with an empty reaction.
+    reactions = select_reactions_batch(reaction_probabilities, session.reaction_labels, top_k)
+    patients = np.repeat(np.arange(len(positions)), [max(len(selected), 1) for selected in reactions])
+    names, probabilities = ([], [])
+    for selected in reactions:
+        names += [name[9:] for name, _ in selected] or [""]
+        probabilities += [float(probability) for _, probability in selected] or [np.nan]
+
+    results = pd.DataFrame({
+        "Row": row_offset + positions[patients],
+        "Serious": serious_values[patients],
+        "Reaction": names,
+        "Reaction Probability": probabilities
+    })
+    if id_column in chunk.columns:
+        results.insert(0, id_column, chunk[id_column].to_numpy()[positions[patients]])
+    return (results, skipped)
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Score a CSV/Parquet file of patients with the serious and reaction models.")
+    parser.add_argument("input", help="Patient file (.csv or .parquet)")
+    parser.add_argument("output", help="Results file (.csv or .parquet)")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Rows scored per chunk")
+    parser.add_argument("--top-k", type=int, default=None, help="Report at most this many reactions per patient")
+    parser.add_argument("--id-column", default="Case ID", help="Input column copied to the output")
+    parser.add_argument("--threads", type=int, default=None, help="Torch CPU threads for the forward passes (default: torch's own choice)")
+    parser.add_argument("--serious-model", default="serious_model.pth")
+    parser.add_argument("--reaction-model", default="reaction_model.pth")
+    parser.add_argument("--scaler", default=os.path.join("Models", "scaler.pkl"))
+    parser.add_argument("--labels", default=os.path.join("Models", "reaction_labels.npz"))
+    args = parser.parse_args(argv)
+
+    if args.threads is not None:
+        set_inference_threads(args.threads)
+    serious_model = Model()
+    reaction_model = Model()
+    serious_model.load_model(args.serious_model)
+    reaction_model.load_model(args.reaction_model)
+    session = InferenceSession(serious_model, reaction_model, scaler_path=args.scaler, labels_path=args.labels)
+
+    writer = ResultWriter(args.output)
+    rows = 0
+    skipped = []
+    start = time.perf_counter()
+    try:
+        for chunk in read_chunks(args.input, args.chunk_size, args.id_column):
+            results, chunk_skipped = score_chunk(session, chunk, args.id_column, args.top_k, rows)
+            if results is not None:
+                writer.write(results)
+            skipped.extend(chunk_skipped.tolist())
+            rows += len(chunk)
+            elapsed = time.perf_counter() - start
+            print(f"\r{rows} rows scored, {rows / elapsed:.0f} rows/s", end="", file=sys.stderr, flush=True)
+    finally:
+        writer.close()
+    print(file=sys.stderr)
+    if skipped:
+        shown = ", ".join(str(row) for row in skipped[:20]) + (", ..." if len(skipped) > 20 else "")
+        print(f"Skipped {len(skipped)} rows with a missing or non-numeric age or weight: {shown}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
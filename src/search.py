@@ -0,0 +1,55 @@
+import numpy as np
+
+class OptionIndex:
+    """
+    Case-insensitive substring search over a fixed list of options.
+
+    Every 1-, 2- and 3-character substring of each lower-cased option maps to
+    the sorted ids of the options containing it. A query intersects the
+    postings of its n-grams, rarest first, and only the surviving candidates
+    are checked with a real substring test, so a keystroke does not scan the
+    whole vocabulary.
+    """
+    NGRAM = 3
+
+    def __init__(self, options: list) -> None:
+        self.options = list(options)
+        self.lowered = [option.lower() for option in self.options]
+
+        postings = {}
+        for option_id, text in enumerate(self.lowered):
+            grams = {text[start:start + size] for size in range(1, self.NGRAM + 1) for start in range(len(text) - size + 1)}
+            for gram in grams:
+                postings.setdefault(gram, []).append(option_id)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def _candidates(self, query: str) -> np.ndarray:
+        if len(query) <= self.NGRAM:
+            return self.postings.get(query, np.empty(0, dtype=np.int32))
+
+        grams = {query[start:start + self.NGRAM] for start in range(len(query) - self.NGRAM + 1)}
+        lists = sorted((self.postings.get(gram, np.empty(0, dtype=np.int32)) for gram in grams), key=len)
+        candidates = lists[0]
+        for ids in lists[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(candidates, ids, assume_unique=True)
+        return candidates
+
+    def search(self, query: str, limit: int=None) -> tuple:
+        """Returns (matching options in original order, whether more matches were cut off)."""
+        query = query.lower()
+        if not query:
+            matches = self.options if limit is None else self.options[:limit]
+            return (list(matches), limit is not None and len(self.options) > limit)
+
+        candidates = self._candidates(query)
+        verify = len(query) > self.NGRAM
+        matches = []
+        for option_id in candidates:
+            if verify and query not in self.lowered[option_id]:
+                continue
+            if limit is not None and len(matches) == limit:
+                return (matches, True)
+            matches.append(self.options[option_id])
+        return (matches, False)
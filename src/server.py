@@ -0,0 +1,347 @@
+"""
+Local prediction service over the serious -> reaction models.
+
+    python -m src.server --port 8080
+    python -m src.server --unix /tmp/faers.sock
+
+    POST /predict  {"sex": "Female", "age": 83, "weight": 65, "medications": ["Insulin Aspart"], "top_k": 10}
+                   -> {"serious": 1, "reactions": [{"reaction": "...", "probability": 0.91}, ...]}
+    GET  /healthz  the process is up
+    GET  /readyz   models are loaded and warmed up
+    GET  /metrics  request latency percentiles, batch sizes and status counts (Prometheus text)
+
+Concurrent requests are queued on the event loop and scored together: a batch
+is closed when it has --max-batch-size requests or --max-wait-ms after its
+first request arrived, whichever comes first. The forward passes run on a
+single worker thread, so the event loop keeps accepting requests meanwhile
+and the next batch is already queued when the current one finishes.
+"""
+import os
+import json
+import math
+import signal
+import asyncio
+import argparse
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from .model import Model, set_inference_threads
+from .inference import InferenceSession, select_reactions
+from .instrumentation import instrumentation
+from .score import GENDERS, parse_medications
+
+MAX_BODY_BYTES = 1 << 20
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+class LatencyWindow:
+    """Most recent `size` observations, summarised as percentiles on demand."""
+    def __init__(self, size: int=10000) -> None:
+        self.values = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float) -> None:
+        self.values.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentiles(self, quantiles=(0.5, 0.9, 0.99)) -> dict:
+        if not self.values:
+            return {quantile: 0.0 for quantile in quantiles}
+        return dict(zip(quantiles, np.quantile(np.fromiter(self.values, dtype=np.float64), quantiles)))
+
+    def to_prometheus(self, metric: str, help_text: str) -> list:
+        lines = [f"# HELP {metric} {help_text}", f"# TYPE {metric} summary"]
+        lines += [f'{metric}{{quantile="{quantile}"}} {value}' for quantile, value in self.percentiles().items()]
+        lines += [f"{metric}_sum {self.total}", f"{metric}_count {self.count}"]
+        return lines
+
+class MicroBatcher:
+    """
+    Coalesces concurrent predict calls into one predict_profiles call per batch.
+    """
+    def __init__(self, session: InferenceSession, max_batch_size: int=64, max_wait: float=0.005) -> None:
+        self.session = session
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="predict")
+        self.batch_sizes = LatencyWindow()
+        self.queue = None
+        self.task = None
+
+    def start(self) -> None:
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    async def run_in_worker(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def submit(self, gender: int, age: float, weight: float, medications: list) -> tuple:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(((gender, age, weight, medications), future))
+        return await future
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Requests whose handler was cancelled while queued (e.g. at shutdown) are not scored
+        return [(profile, future) for profile, future in batch if not future.done()]
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+
+            self.batch_sizes.add(len(batch))
+            genders, ages, weights, medications = (list(values) for values in zip(*(profile for profile, _ in batch)))
+            try:
+                serious_values, reaction_probabilities = await self.run_in_worker(self.session.predict_profiles, genders, ages, weights, medications)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            for (_, future), serious_value, probabilities in zip(batch, serious_values, reaction_probabilities):
+                if not future.done():
+                    future.set_result((int(serious_value), probabilities))
+
+class PredictionServer:
+    def __init__(self, session: InferenceSession, max_batch_size: int=64, max_wait_ms: float=5.0, top_k: int=None) -> None:
+        self.session = session
+        self.batcher = MicroBatcher(session, max_batch_size, max_wait_ms / 1000)
+        self.top_k = top_k
+        self.ready = False
+        self.latencies = LatencyWindow()
+        self.responses = Counter()
+
+    async def start(self, host: str="127.0.0.1", port: int=8080, unix_path: str=None):
+        self.batcher.start()
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+
+        # Load the label artifact and run one batch before reporting ready, so the first request is not the slow one
+        await self.batcher.run_in_worker(lambda: self.session.reaction_labels)
+        await self.batcher.run_in_worker(self.session.predict_profiles, [0], [0.0], [0.0], [[]])
+        self.ready = True
+        return server
+
+    async def stop(self) -> None:
+        self.ready = False
+        await self.batcher.stop()
+
+    def parse_profile(self, body: bytes) -> tuple:
+        try:
+            request = json.loads(body)
+            sex = str(request["sex"]).strip().lower()
+            age = float(request["age"])
+            weight = float(request["weight"])
+            medications = request.get("medications", [])
+            top_k = request.get("top_k", self.top_k)
+        except (ValueError, KeyError, TypeError) as error:
+            raise RequestError(400, f"Invalid request body: {error}")
+
+        if not (math.isfinite(age) and math.isfinite(weight)):
+            raise RequestError(400, "age and weight must be finite numbers")
+        if sex not in GENDERS:
+            raise RequestError(400, f"Unrecognised sex {request['sex']!r}")
+        if isinstance(medications, list):
+            medications = ";".join(str(med) for med in medications)
+        elif not isinstance(medications, str):
+            raise RequestError(400, "medications must be a list of names or a \";\"-separated string")
+        medications = parse_medications(medications)
+        try:
+            self.session.medication_columns(medications)
+        except ValueError as error:
+            raise RequestError(400, str(error))
+        if top_k is not None and (not isinstance(top_k, int) or top_k < 1):
+            raise RequestError(400, "top_k must be a positive integer")
+        return (GENDERS[sex], age, weight, medications, top_k)
+
+    async def predict(self, body: bytes) -> dict:
+        if not self.ready:
+            raise RequestError(503, "Models are still loading")
+        gender, age, weight, medications, top_k = self.parse_profile(body)
+        serious_value, probabilities = await self.batcher.submit(gender, age, weight, medications)
+        reactions = select_reactions(probabilities, self.session.reaction_labels, top_k)
+        return {
+            "serious": serious_value,
+            "reactions": [{"reaction": name[9:], "probability": float(probability)} for name, probability in reactions]
+        }
+
+    def metrics(self) -> str:
+        lines = self.latencies.to_prometheus("faers_predict_latency_seconds", "Time from request received to response ready")
+        lines += self.batcher.batch_sizes.to_prometheus("faers_predict_batch_size", "Requests scored per forward pass")
+        lines += ["# HELP faers_http_responses_total Responses by status code", "# TYPE faers_http_responses_total counter"]
+        lines += [f'faers_http_responses_total{{code="{status}"}} {count}' for status, count in sorted(self.responses.items())]
+        lines += ["# HELP faers_ready Whether the models are loaded", "# TYPE faers_ready gauge", f"faers_ready {int(self.ready)}"]
+        text = "\n".join(lines) + "\n"
+        if instrumentation.enabled:
+            text += instrumentation.to_prometheus()
+        return text
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> tuple:
+        routes = {"/predict": "POST", "/healthz": "GET", "/readyz": "GET", "/metrics": "GET"}
+        if path not in routes:
+            raise RequestError(404, f"No route {path}")
+        if method != routes[path]:
+            raise RequestError(405, f"{path} expects {routes[path]}")
+
+        if path == "/predict":
+            start = asyncio.get_running_loop().time()
+            result = await self.predict(body)
+            self.latencies.add(asyncio.get_running_loop().time() - start)
+            return (200, result)
+        if path == "/healthz":
+            return (200, {"status": "ok"})
+        if path == "/readyz":
+            return (200, {"status": "ready"}) if self.ready else (503, {"status": "starting"})
+        return (200, self.metrics())
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # Minimal HTTP/1.1: Content-Length bodies and keep-alive, which is all the clients of this service need
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    method, path, version, length = self.parse_head(request_line, headers)
+                    keep_alive = keep_alive and version == "HTTP/1.1"
+                    body = await reader.readexactly(length) if length else b""
+                except RequestError as error:
+                    # The rest of the stream can't be trusted to start at a request boundary
+                    status, payload, keep_alive = (error.status, {"error": str(error)}, False)
+                else:
+                    try:
+                        status, payload = await self.dispatch(method, path, body)
+                    except RequestError as error:
+                        status, payload = (error.status, {"error": str(error)})
+                    except Exception as error:
+                        status, payload = (500, {"error": f"{type(error).__name__}: {error}"})
+
+                self.responses[status] += 1
+                writer.write(self.render(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def parse_head(request_line: bytes, headers: dict) -> tuple:
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise RequestError(400, "Malformed request")
+        if length < 0:
+            raise RequestError(400, "Malformed request")
+        if length > MAX_BODY_BYTES:
+            raise RequestError(413, f"Request body over {MAX_BODY_BYTES} bytes")
+        return (method, target.split("?", 1)[0], version, length)
+
+    @staticmethod
+    def render(status: int, payload, keep_alive: bool) -> bytes:
+        if isinstance(payload, str):
+            content_type, body = ("text/plain; version=0.0.4", payload.encode("utf-8"))
+        else:
+            content_type, body = ("application/json", json.dumps(payload).encode("utf-8"))
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        return head.encode("latin-1") + body
+
+async def serve(session: InferenceSession, host: str, port: int, unix_path: str, max_batch_size: int, max_wait_ms: float, top_k: int) -> None:
+    prediction_server = PredictionServer(session, max_batch_size, max_wait_ms, top_k)
+    server = await prediction_server.start(host, port, unix_path)
+    print(f"Serving on {unix_path or f'http://{host}:{port}'}", flush=True)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signal_number, stopping.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl+C still ends asyncio.run
+
+    try:
+        await stopping.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await prediction_server.stop()
+        if unix_path and os.path.exists(unix_path):
+            os.remove(unix_path)
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Serve serious and reaction predictions over HTTP with dynamic micro-batching.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix", default=None, help="Listen on this Unix socket path instead of TCP")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="Most requests scored in one forward pass")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Longest a request waits for others to join its batch")
+    parser.add_argument("--top-k", type=int, default=None, help="Default limit on reactions per response")
+    parser.add_argument("--threads", type=int, default=None, help="Torch CPU threads for the forward passes (default: torch's own choice)")
+    parser.add_argument("--serious-model", default="serious_model.pth")
+    parser.add_argument("--reaction-model", default="reaction_model.pth")
+    parser.add_argument("--scaler", default=os.path.join("Models", "scaler.pkl"))
+    parser.add_argument("--labels", default=os.path.join("Models", "reaction_labels.npz"))
+    args = parser.parse_args(argv)
+
+    if args.threads is not None:
+        set_inference_threads(args.threads)
+    serious_model = Model()
+    reaction_model = Model()
+    serious_model.load_model(args.serious_model)
+    reaction_model.load_model(args.reaction_model)
+    session = InferenceSession(serious_model, reaction_model, scaler_path=args.scaler, labels_path=args.labels)
+
+    asyncio.run(serve(session, args.host, args.port, args.unix, args.max_batch_size, args.max_wait_ms, args.top_k))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+class Vocabulary:
+    """
+    Ordered token -> column index mapping for multi-hot features.
+
+    Tokens are only ever appended, so column indices stay stable as the
+    vocabulary grows.
+    """
+    def __init__(self, tokens=(), prefix: str="") -> None:
+        self.prefix = prefix
+        self.tokens = []
+        self._index = None
+        self.extend(tokens)
+
+    @classmethod
+    def from_values(cls, values, prefix: str=""):
+        # Sorted to match the column order produced by pd.get_dummies
+        return cls(sorted(pd.unique(pd.Series(values).dropna())), prefix=prefix)
+
+    def extend(self, tokens) -> int:
+        known = set(self.tokens)
+        new_tokens = [token for token in pd.unique(pd.Series(tokens, dtype=object).dropna()) if token not in known]
+        if new_tokens:
+            self.tokens.extend(new_tokens)
+            self._index = None
+        return len(new_tokens)
+
+    def lookup(self, tokens) -> np.ndarray:
+        if self._index is None:
+            self._index = pd.Index(self.tokens)
+        return self._index.get_indexer(tokens)
+
+    @property
+    def columns(self) -> list:
+        return [f"{self.prefix}{token}" for token in self.tokens]
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __contains__(self, token) -> bool:
+        return self.lookup([token])[0] >= 0